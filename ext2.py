@@ -2,9 +2,55 @@ import os
 import json
 import sys
 import re
-import pdfplumber
-from collections import defaultdict
+import heapq
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import itertools
+import ctypes
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+
+try:
+    # Optional: orjson serializes several times faster than the stdlib encoder
+    import orjson
+except ImportError:
+    orjson = None
+
+# Lines that can never be headings, folded into one alternation so a line is scanned once.
+NON_HEADING = re.compile(r"""
+      \.{4,}\s*\d+$                        # Table of Contents entry, e.g. "Introduction ..... 5"
+    | ^\d\.\d\s+[A-Z0-9\s]+$               # "Revision History" table data from file02.pdf
+    | ^(?i:Page\s*\d+(?:\s*of\s*\d+)?)$     # page footer, e.g. "Page 3 of 10"
+    | ^\d+$                                # bare page number
+""", re.VERBOSE)
+NUM_LIST = re.compile(r'^\d+\.\s')
+BOLD_FONT = re.compile(r'bold|black|heavy', re.IGNORECASE)
+# A visible character repeated three or more times in a row, the signature of garbled extraction.
+GARBLED = re.compile(r'(\S)\1{2,}')
+# Numbered headings, deepest level first; the named group that matched gives the level.
+HNUM = re.compile(
+    r'^(?:(?P<h4>\d+\.\d+\.\d+\.\d+)|(?P<h3>\d+\.\d+\.\d+)|(?P<h2>\d+\.\d+)'
+    r'|(?P<h1>(?:Appendix\s[A-Z]|\d+))\.)\s+'
+)
+HNUM_LEVELS = {"h1": "H1", "h2": "H2", "h3": "H3", "h4": "H4"}
+# Horizontal gap (in points) between two chars that is treated as a word break.
+X_TOLERANCE = 3
+# Vertical gap (in points) between two chars that starts a new line, as in pdfplumber's
+# cluster_objects. Glyphs from different fonts on one line (e.g. a SymbolMT bullet next
+# to its bold label) sit a fraction of a point apart and must stay on the same line.
+Y_TOLERANCE = 3
+
+# The per-character fields the outline logic needs, in PDF coordinates (y grows upwards).
+PageChar = namedtuple('PageChar', ['text', 'size', 'fontname', 'x0', 'x1', 'y0'])
+
+@functools.lru_cache(maxsize=None)
+def is_bold_font(font_name):
+    """
+    Returns True if the font name denotes a bold/black/heavy weight. Documents
+    only use a handful of distinct fonts, so results are cached per name.
+    """
+    return BOLD_FONT.search(font_name) is not None
 
 def clean_text(text):
     """
@@ -12,49 +58,115 @@ def clean_text(text):
     and removing consecutive duplicate characters that can appear from OCR/extraction errors.
     """
     # Fix for garbled text like "RRRFFFFPPPP..." -> "RFP"
-    text = ''.join(c for c, _ in itertools.groupby(text))
-    return re.sub(r'\s+', ' ', text).strip()
+    # Only pay for the character-level dedup when a run is actually present.
+    garbled = GARBLED.search(text)
+    # Most lines are already clean: no runs, no double spaces and no whitespace
+    # other than ' ' (isprintable() is False for tabs, newlines, NBSP, ...).
+    if not garbled and '  ' not in text and text.isprintable():
+        return text.strip()
+    if garbled:
+        text = ''.join(c for c, _ in itertools.groupby(text))
+    return ' '.join(text.split())
+
+def iter_page_chars(pdf_path):
+    """
+    Yields the characters of each page as PageChar records, read through PDFium's
+    native text engine. Size and coordinates come from the loose char box (font
+    ascent to descent), which matches the size/y0 pdfminer reports for a char.
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    font_name_buf = ctypes.create_string_buffer(256)
+    try:
+        for page in pdf:
+            textpage = page.get_textpage()
+            chars = []
+            for i in range(textpage.count_chars()):
+                text = chr(pdfium_c.FPDFText_GetUnicode(textpage.raw, i))
+                if pdfium_c.FPDFText_IsGenerated(textpage.raw, i):
+                    # PDFium synthesizes line breaks (dropped, lines come from y0) and
+                    # word spaces missing from the content stream. A synthesized space
+                    # is pinned to the preceding char so it sorts right after it.
+                    if text == ' ' and chars:
+                        chars.append(chars[-1]._replace(text=' '))
+                    continue
+                x0, y0, x1, y1 = textpage.get_charbox(i, loose=True)
+                name_len = pdfium_c.FPDFText_GetFontInfo(
+                    textpage.raw, i, font_name_buf, len(font_name_buf), None)
+                font_name = font_name_buf.value.decode('utf-8', 'replace') if name_len else ''
+                chars.append(PageChar(text, y1 - y0, font_name, x0, x1, y0))
+            textpage.close()
+            page.close()
+            yield chars
+    finally:
+        pdf.close()
+
+def build_page_lines(chars, font_sizes=None):
+    """
+    Groups a page's characters into text lines (top to bottom) in a single pass,
+    tallying each character's font size into the `font_sizes` Counter along the way.
+    """
+    if font_sizes is not None:
+        font_sizes.update(round(char.size, 2) for char in chars)
+
+    # PDF y-coordinates grow upwards, so sorting on -y0 puts the top-most line first.
+    # A new line starts only where the gap to the previous char exceeds Y_TOLERANCE.
+    rows = []
+    prev_y0 = None
+    for char in sorted(chars, key=lambda c: -c.y0):
+        if prev_y0 is None or prev_y0 - char.y0 > Y_TOLERANCE:
+            rows.append([])
+        rows[-1].append(char)
+        prev_y0 = char.y0
+
+    lines = []
+    for row in rows:
+        line_chars = sorted(row, key=lambda c: c.x0)
+        text_parts = []
+        prev_x1 = None
+        for char in line_chars:
+            if prev_x1 is not None and char.x0 - prev_x1 > X_TOLERANCE:
+                text_parts.append(' ')
+            text_parts.append(char.text)
+            prev_x1 = char.x1
+        lines.append({"text": ''.join(text_parts), "chars": line_chars})
+    return lines
 
 def is_likely_heading(line_text, font_size, is_bold, font_stats, line_word_count):
     """
     A much stricter collection of heuristics to determine if a line is a heading.
     This is the core filtering logic to improve precision.
     """
+    # Cheap length/attribute checks run first so most body text is rejected
+    # before any regex is evaluated.
+
     # Rule 1: Must have some text.
     if not line_text or len(line_text) < 3:
         return False
 
-    # Rule 2: Filter out Table of Contents entries (e.g., "Introduction ..... 5")
-    if re.search(r'\.{4,}\s*\d+$', line_text):
-        return False
-
-    # Rule 3: Filter out lines that are likely body text or list items.
+    # Rule 2: Filter out lines that are likely body text or list items.
     # Headings are typically short and don't end with punctuation like a sentence.
     if line_word_count > 12 or line_text.endswith(','):
         return False
-    
-    # Rule 4: Specifically filter out the "Revision History" table data from file02.pdf
-    if re.match(r'^\d\.\d\s+[A-Z0-9\s]+$', line_text):
-        return False
-
-    # Rule 5: Filter out numbered list items that are full sentences.
-    # A real heading like "1. Introduction" is short. A list item is often long.
-    if re.match(r'^\d+\.\s', line_text) and line_word_count > 8:
-        # This is likely a list item, e.g., "1. Professionals who have achieved..."
-        return False
 
-    # Rule 6: Filter out lines that are all uppercase but not styled like a major heading.
+    # Rule 3: Filter out lines that are all uppercase but not styled like a major heading.
     if line_text.isupper() and line_word_count > 1 and font_size < font_stats['h2_font_threshold']:
         return False
 
-    # Rule 7: Filter out lines that are likely just page numbers or footers.
-    if re.fullmatch(r'Page\s*\d+(\s*of\s*\d+)?', line_text, re.IGNORECASE) or re.fullmatch(r'\d+', line_text):
-        return False
-        
-    # Rule 8: Filter out form field labels from file01.pdf
-    if re.match(r'^\d+\.\s', line_text) and not is_bold and font_size < font_stats['h2_font_threshold']:
+    # Rule 4: Filter out TOC entries, revision-history rows, page numbers and footers.
+    if NON_HEADING.search(line_text):
         return False
 
+    if NUM_LIST.match(line_text):
+        # Rule 5: Filter out numbered list items that are full sentences.
+        # A real heading like "1. Introduction" is short. A list item is often long,
+        # e.g., "1. Professionals who have achieved..."
+        if line_word_count > 8:
+            return False
+
+        # Rule 6: Filter out form field labels from file01.pdf
+        if not is_bold and font_size < font_stats['h2_font_threshold']:
+            return False
+
     return True
 
 
@@ -64,112 +176,133 @@ def extract_outline_with_pdfplumber(pdf_path):
     using a more robust hybrid approach.
     """
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            if not pdf.pages:
-                return {"title": "Empty Document", "outline": []}
-
-            # --- Phase 1: Gather Font Statistics ---
-            font_sizes = defaultdict(int)
-            for page in pdf.pages:
-                for char in page.chars:
-                    font_sizes[round(char.get('size', 0), 2)] += 1
-            
-            sorted_sizes = sorted(font_sizes.keys(), reverse=True)
-            font_stats = {
-                'h1_font_threshold': sorted_sizes[0] if len(sorted_sizes) > 0 else 0,
-                'h2_font_threshold': sorted_sizes[1] if len(sorted_sizes) > 1 else 0,
-                'h3_font_threshold': sorted_sizes[2] if len(sorted_sizes) > 2 else 0,
-                'h4_font_threshold': sorted_sizes[3] if len(sorted_sizes) > 3 else 0
-            }
-
-            # --- Phase 2: Title Extraction (Improved) ---
-            title = ""
-            first_page = pdf.pages[0]
-            max_font_size = font_stats['h1_font_threshold']
-            if max_font_size > 0:
-                # Group all words with the max font size by their line (y-coordinate)
-                lines_with_max_font = defaultdict(list)
-                for word in first_page.extract_words(y_tolerance=3):
-                    if abs(word.get('size', 0) - max_font_size) < 0.1:
-                        y0 = round(word.get('y0', 0))
-                        lines_with_max_font[y0].append(word['text'])
-                
-                # Combine the top-most lines that have the max font size
-                if lines_with_max_font:
-                    sorted_y_coords = sorted(lines_with_max_font.keys())
-                    # Combine up to the top 3 lines for the title
-                    title_parts = [" ".join(lines_with_max_font[y]) for y in sorted_y_coords[:3]]
-                    title = clean_text(" ".join(title_parts))
-
-            if not title or len(title) < 5:
-                title = "Untitled Document"
-
-
-            # --- Phase 3: Heading Extraction ---
-            outline = []
-            h_patterns = {
-                "H1": re.compile(r"^(Appendix\s[A-Z]|\d+)\.\s+.*"),
-                "H2": re.compile(r"^\d+\.\d+\s+.*"),
-                "H3": re.compile(r"^\d+\.\d+\.\d+\s+.*"),
-                "H4": re.compile(r"^\d+\.\d+\.\d+\.\d+\s+.*"),
-            }
-
-            for page_num, page in enumerate(pdf.pages, 1):
-                lines = page.extract_text_lines(layout=True, strip=True)
+        pages_chars = list(iter_page_chars(pdf_path))
+        if not pages_chars:
+            return {"title": "Empty Document", "outline": []}
+
+        # --- Phase 1: Build Lines and Gather Font Statistics in one pass ---
+        font_sizes = Counter()
+        pages_lines = [build_page_lines(chars, font_sizes) for chars in pages_chars]
+        
+        # Only the four largest sizes matter, so avoid sorting every distinct size
+        top_sizes = heapq.nlargest(4, font_sizes.keys())
+        font_stats = {
+            'h1_font_threshold': top_sizes[0] if len(top_sizes) > 0 else 0,
+            'h2_font_threshold': top_sizes[1] if len(top_sizes) > 1 else 0,
+            'h3_font_threshold': top_sizes[2] if len(top_sizes) > 2 else 0,
+            'h4_font_threshold': top_sizes[3] if len(top_sizes) > 3 else 0
+        }
+
+        # --- Phase 2: Title Extraction (Improved) ---
+        title = ""
+        max_font_size = font_stats['h1_font_threshold']
+        # The title must be set larger than the body text; when the largest size is also
+        # the most common one, the top lines of that size are just the first paragraph.
+        body_font_size = font_sizes.most_common(1)[0][0] if font_sizes else 0
+        if max_font_size > body_font_size:
+            # Group all first-page characters with the max font size into lines
+            title_chars = [char for char in pages_chars[0] if abs(char.size - max_font_size) < 0.1]
+
+            # Combine up to the top 3 lines that have the max font size
+            title_parts = [line['text'] for line in build_page_lines(title_chars)[:3]]
+            if title_parts:
+                title = clean_text(" ".join(title_parts))
+
+        if not title or len(title) < 5:
+            title = "Untitled Document"
+
+
+        # --- Phase 3: Heading Extraction ---
+        outline = []
+        for page_num, lines in enumerate(pages_lines, 1):
+            for line in lines:
+                line_text = clean_text(line['text'])
+                line_word_count = len(line_text.split())
                 
-                for line in lines:
-                    line_text = clean_text(line['text'])
-                    line_word_count = len(line_text.split())
-                    
-                    first_char = next((c for c in line['chars'] if c['text'].strip()), None)
+                # Lines are never empty and rarely start with a space, so only scan
+                # past the first char when it is whitespace.
+                first_char = line['chars'][0]
+                if first_char.text.isspace():
+                    first_char = next((c for c in line['chars'] if not c.text.isspace()), None)
                     if not first_char: continue
-                        
-                    font_size = round(first_char.get('size', 0), 2)
-                    font_name = first_char.get('fontname', '').lower()
-                    is_bold = 'bold' in font_name or 'black' in font_name or 'heavy' in font_name
+                    
+                font_size = round(first_char.size, 2)
+                is_bold = is_bold_font(first_char.fontname)
 
-                    if not is_likely_heading(line_text, font_size, is_bold, font_stats, line_word_count):
-                        continue
+                if not is_likely_heading(line_text, font_size, is_bold, font_stats, line_word_count):
+                    continue
 
-                    current_level = None
-                    
-                    # Primary Method: Numbered headings
-                    if h_patterns["H4"].match(line_text): current_level = "H4"
-                    elif h_patterns["H3"].match(line_text): current_level = "H3"
-                    elif h_patterns["H2"].match(line_text): current_level = "H2"
-                    elif h_patterns["H1"].match(line_text): current_level = "H1"
-                    
-                    # Fallback Method: Font size and style for un-numbered headings
-                    elif is_bold or line_text.isupper():
-                        if font_size >= font_stats['h1_font_threshold'] * 0.9: current_level = "H1"
-                        elif font_size >= font_stats['h2_font_threshold'] * 0.9: current_level = "H2"
-                        elif font_size >= font_stats['h3_font_threshold'] * 0.9: current_level = "H3"
-
-                    if current_level:
-                        outline.append({
-                            "level": current_level,
-                            "text": line_text,
-                            "page": page_num
-                        })
-
-            # --- Phase 4: Post-processing ---
-            final_outline = []
-            seen_entries = set()
-            for entry in outline:
-                entry_tuple = (entry['text'].lower(), entry['page'])
-                if entry_tuple not in seen_entries:
-                    final_outline.append(entry)
-                    seen_entries.add(entry_tuple)
-
-            return {"title": title, "outline": final_outline}
+                current_level = None
+                
+                # Primary Method: Numbered headings
+                numbered = HNUM.match(line_text)
+                if numbered: current_level = HNUM_LEVELS[numbered.lastgroup]
+                
+                # Fallback Method: Font size and style for un-numbered headings
+                elif is_bold or line_text.isupper():
+                    if font_size >= font_stats['h1_font_threshold'] * 0.9: current_level = "H1"
+                    elif font_size >= font_stats['h2_font_threshold'] * 0.9: current_level = "H2"
+                    elif font_size >= font_stats['h3_font_threshold'] * 0.9: current_level = "H3"
+
+                if current_level:
+                    outline.append({
+                        "level": current_level,
+                        "text": line_text,
+                        "page": page_num
+                    })
+
+        # --- Phase 4: Post-processing ---
+        # dicts keep insertion order, so setdefault retains the first entry for each key
+        unique_entries = {}
+        for entry in outline:
+            unique_entries.setdefault((entry['text'].lower(), entry['page']), entry)
+        final_outline = list(unique_entries.values())
+
+        return {"title": title, "outline": final_outline}
 
     except Exception as e:
         print(f"Error processing PDF '{pdf_path}': {e}", file=sys.stderr)
         return {"title": "Error Processing Document", "outline": []}
 
+def write_json(result, output_path, compact=False):
+    """
+    Writes `result` as UTF-8 JSON in a single write, using orjson when it is installed.
+    Output is indented by 2 spaces (the only indent orjson supports) unless `compact`
+    is set, in which case it is emitted without any whitespace.
+    """
+    if orjson is not None:
+        data = orjson.dumps(result) if compact else orjson.dumps(result, option=orjson.OPT_INDENT_2)
+        with open(output_path, "wb") as f:
+            f.write(data)
+    else:
+        # json.dumps without indent takes the C encoder fast path
+        if compact:
+            data = json.dumps(result, separators=(',', ':'), ensure_ascii=False)
+        else:
+            data = json.dumps(result, indent=2, ensure_ascii=False)
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(data)
+
+def process_pdf(pdf_filename, input_dir, output_dir, compact=False):
+    """
+    Extracts the outline of a single PDF from `input_dir` and writes it as JSON to `output_dir`.
+    """
+    pdf_path = os.path.join(input_dir, pdf_filename)
+    output_filename = os.path.splitext(pdf_filename)[0] + ".json"
+    output_path = os.path.join(output_dir, output_filename)
+
+    print(f"Processing '{pdf_filename}'...")
+    result = extract_outline_with_pdfplumber(pdf_path)
+
+    write_json(result, output_path, compact)
+
+    print(f"Outline for '{pdf_filename}' saved to '{output_path}'")
+
 if __name__ == "__main__":
     input_dir = "input"
     output_dir = "output"
+    # Pass --compact to skip indentation when the JSON is only read by other programs
+    compact = "--compact" in sys.argv[1:]
 
     if not os.path.isdir(input_dir):
         print(f"Error: Input directory '{input_dir}' not found.", file=sys.stderr)
@@ -183,15 +316,7 @@ if __name__ == "__main__":
         print(f"No PDF files found in '{input_dir}' directory.")
         sys.exit(0)
 
-    for pdf_filename in pdf_files:
-        pdf_path = os.path.join(input_dir, pdf_filename)
-        output_filename = os.path.splitext(pdf_filename)[0] + ".json"
-        output_path = os.path.join(output_dir, output_filename)
-
-        print(f"Processing '{pdf_filename}'...")
-        result = extract_outline_with_pdfplumber(pdf_path)
-
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=4, ensure_ascii=False)
-
-        print(f"Outline for '{pdf_filename}' saved to '{output_path}'")
+    # Each PDF is independent and CPU-bound, so spread them across processes.
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(process_pdf, pdf_files, itertools.repeat(input_dir),
+                          itertools.repeat(output_dir), itertools.repeat(compact)))
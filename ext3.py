@@ -2,42 +2,102 @@ import os
 import json
 import sys
 import re
+import numpy as np
 import pdfplumber
-from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import itertools
 
+try:
+    # Optional: orjson serializes several times faster than the stdlib encoder
+    import orjson
+except ImportError:
+    orjson = None
+
+TOC_DOTS = re.compile(r'\.{3,}\s*\d+$')
+REV_HIST = re.compile(r'^\d\.\d\s')
+NUM_PREFIX = re.compile(r'^\d+(\.\d+)*\s')
+BOLD_FONT = re.compile(r'bold|black|heavy', re.IGNORECASE)
+# A visible character repeated three or more times in a row, the signature of garbled extraction.
+GARBLED = re.compile(r'(\S)\1{2,}')
+# Vertical gap (in points) between two words that starts a new line, as in ext2 and
+# pdfplumber's cluster_objects. Words set in different fonts on one baseline have
+# slightly different tops, so lines cannot be split on the exact (rounded) top.
+Y_TOLERANCE = 3
+
+@functools.lru_cache(maxsize=None)
+def is_bold_font(font_name):
+    """
+    Returns True if the font name denotes a bold/black/heavy weight. Documents
+    only use a handful of distinct fonts, so results are cached per name.
+    """
+    return BOLD_FONT.search(font_name) is not None
+
 def clean_text(text):
     """
     Cleans extracted text by stripping whitespace, normalizing internal spaces,
     and removing consecutive duplicate characters from OCR/extraction errors.
     """
     # Fix for garbled text like "R...F...P..." -> "RFP"
-    text = ''.join(c for c, _ in itertools.groupby(text))
-    return re.sub(r'\s+', ' ', text).strip()
+    # Only pay for the character-level dedup when a run is actually present.
+    garbled = GARBLED.search(text)
+    # Most lines are already clean: no runs, no double spaces and no whitespace
+    # other than ' ' (isprintable() is False for tabs, newlines, NBSP, ...).
+    if not garbled and '  ' not in text and text.isprintable():
+        return text.strip()
+    if garbled:
+        text = ''.join(c for c, _ in itertools.groupby(text))
+    return ' '.join(text.split())
+
+def extract_page_words(page):
+    """
+    Extracts a page's words along with the font attributes the later phases rely on.
+    """
+    # Use extract_words to get font size info, which is more reliable than chars.
+    # extract_words only reports size/fontname when asked for them explicitly.
+    return page.extract_words(x_tolerance=2, y_tolerance=2, extra_attrs=["size", "fontname"])
+
+def word_columns(words):
+    """
+    Copies the numeric word fields used for filtering and line grouping into
+    NumPy arrays, so the per-word work below runs as vectorized scans.
+    Sizes are rounded to whole points (half-to-even, like round()); tops are kept
+    unrounded for the tolerance-based line grouping.
+    """
+    count = len(words)
+    sizes = np.rint(np.fromiter((w.get('size', 0) for w in words), dtype=np.float64, count=count)).astype(np.int64)
+    tops = np.fromiter((w.get('top', 0) for w in words), dtype=np.float64, count=count)
+    x0s = np.fromiter((w.get('x0', 0) for w in words), dtype=np.float64, count=count)
+    return sizes, tops, x0s
+
+def group_word_lines(words, tops, x0s, indices):
+    """
+    Yields the words at `indices` grouped into lines, top to bottom and left to right.
+    A new line starts where the gap between consecutive sorted tops exceeds Y_TOLERANCE.
+    """
+    order = indices[np.argsort(tops[indices], kind='stable')]
+    if order.size == 0:
+        return
+    line_starts = np.flatnonzero(np.diff(tops[order]) > Y_TOLERANCE) + 1
+    for line in np.split(order, line_starts):
+        yield [words[i] for i in line[np.argsort(x0s[line], kind='stable')]]
 
-def analyze_document_styles(pdf):
+def analyze_document_styles(font_sizes):
     """
     Analyzes the entire document to find the most common font size (body text)
     and a ranked list of larger font sizes (potential headings).
+    `font_sizes` holds the rounded font size of every word in the document.
     """
-    font_sizes = defaultdict(int)
-    for page in pdf.pages:
-        # Use extract_words to get font size info, which is more reliable than chars
-        words = page.extract_words(x_tolerance=2, y_tolerance=2)
-        for word in words:
-            # Round the size to handle minor floating point variations
-            size = round(word.get('size', 0))
-            font_sizes[size] += 1
-    
-    if not font_sizes:
+    if font_sizes.size == 0:
         return 0, []
 
     # Find the most frequent font size, which is almost always the body text.
-    body_size = max(font_sizes, key=font_sizes.get)
+    sizes, counts = np.unique(font_sizes, return_counts=True)
+    body_size = int(sizes[np.argmax(counts)])
     
     # Identify heading sizes as those that are significantly larger than the body text.
     # A +1 buffer helps avoid minor font variations being misclassified.
-    heading_sizes = sorted([size for size in font_sizes if size > body_size + 1], reverse=True)
+    heading_sizes = sizes[sizes > body_size + 1][::-1].tolist()
     
     return body_size, heading_sizes
 
@@ -51,8 +111,13 @@ def extract_outline_with_pdfplumber(pdf_path):
             if not pdf.pages:
                 return {"title": "Empty Document", "outline": []}
 
+            # Extract every page's words exactly once; all phases below reuse them.
+            all_pages_words = [extract_page_words(page) for page in pdf.pages]
+            all_pages_columns = [word_columns(words) for words in all_pages_words]
+
             # --- Phase 1: Analyze document-wide font styles ---
-            body_size, heading_sizes = analyze_document_styles(pdf)
+            body_size, heading_sizes = analyze_document_styles(
+                np.concatenate([sizes for sizes, _, _ in all_pages_columns]))
             
             # Create a mapping from a font size to its heading level (H1, H2, etc.)
             level_map = {size: f"H{i+1}" for i, size in enumerate(heading_sizes)}
@@ -61,74 +126,52 @@ def extract_outline_with_pdfplumber(pdf_path):
             title = "Untitled Document"
             if heading_sizes:
                 max_heading_size = heading_sizes[0]
-                first_page = pdf.pages[0]
                 
-                potential_titles = []
                 # Find all words on the first page that match the largest heading font size
-                for word in first_page.extract_words(y_tolerance=3):
-                    if round(word.get('size', 0)) == max_heading_size:
-                        potential_titles.append(word)
+                sizes, tops, x0s = all_pages_columns[0]
+                potential_titles = np.flatnonzero(sizes == max_heading_size)
                 
-                if potential_titles:
-                    # Group title words by their line (y-coordinate) to handle multi-line titles
-                    title_lines = defaultdict(list)
-                    for word in potential_titles:
-                        y0 = round(word.get('y0', 0))
-                        title_lines[y0].append(word['text'])
-                    
-                    if title_lines:
-                        # Join the top-most lines that share the max font size
-                        sorted_y = sorted(title_lines.keys())
-                        # Combine the text from all detected title lines
-                        full_title = " ".join([" ".join(title_lines[y]) for y in sorted_y])
-                        cleaned_title = clean_text(full_title)
-                        if cleaned_title: # Ensure the title is not empty after cleaning
-                            title = cleaned_title
+                if potential_titles.size:
+                    # Group title words by line (y-coordinate) to handle multi-line titles
+                    title_lines = group_word_lines(all_pages_words[0], tops, x0s, potential_titles)
+
+                    # Combine the text from all detected title lines, top-most first
+                    full_title = " ".join(" ".join(w['text'] for w in line_words) for line_words in title_lines)
+                    cleaned_title = clean_text(full_title)
+                    if cleaned_title: # Ensure the title is not empty after cleaning
+                        title = cleaned_title
 
 
             # --- Phase 3: Outline Extraction with Stricter, More Precise Filtering ---
             outline = []
-            for page_num, page in enumerate(pdf.pages, 1):
-                words = page.extract_words(x_tolerance=2, y_tolerance=2)
-                
-                lines = defaultdict(list)
-                for word in words:
-                    y0 = round(word.get('y0', 0))
-                    lines[y0].append(word)
-
-                sorted_y_coords = sorted(lines.keys())
-
-                for y in sorted_y_coords:
-                    line_words = sorted(lines[y], key=lambda w: w.get('x0', 0))
-                    if not line_words: continue
+            for page_num, (words, (sizes, tops, x0s)) in enumerate(zip(all_pages_words, all_pages_columns), 1):
+                # --- ADVANCED FILTERING LOGIC ---
+                # Rule 1: Must have a font size that was pre-identified as a heading size.
+                # Applied per word before grouping, since body text is the vast majority of words.
+                candidate_words = np.flatnonzero(np.isin(sizes, heading_sizes))
 
+                for line_words in group_word_lines(words, tops, x0s, candidate_words):
                     line_text = clean_text(" ".join([w['text'] for w in line_words]))
                     first_word = line_words[0]
                     font_size = round(first_word.get('size', 0))
-                    font_name = first_word.get('fontname', '').lower()
-                    is_bold = 'bold' in font_name or 'black' in font_name or 'heavy' in font_name
+                    is_bold = is_bold_font(first_word.get('fontname', ''))
 
-                    # --- ADVANCED FILTERING LOGIC ---
-                    # Rule 1: Must have a font size that was pre-identified as a heading size.
-                    if font_size not in heading_sizes:
-                        continue
-                    
                     # Rule 2: Must be bold OR all caps. This is a strong indicator for headings.
                     if not is_bold and not line_text.isupper():
                         continue
 
                     # Rule 3: Filter out Table of Contents lines with leader dots.
-                    if re.search(r'\.{3,}\s*\d+$', line_text):
+                    if TOC_DOTS.search(line_text):
                         continue
                         
                     # Rule 4: Filter out Revision History table data from file02.pdf (e.g., "0.1 18 JUNE...")
-                    if re.match(r'^\d\.\d\s', line_text):
+                    if REV_HIST.match(line_text):
                         continue
 
                     # Rule 5: THIS IS THE KEY IMPROVEMENT. Distinguish headings from list items.
                     # A real heading is concise. A list item is often a full sentence.
                     # If a line starts with a number pattern but is long, it's a list item, not a heading.
-                    if re.match(r'^\d+(\.\d+)*\s', line_text) and len(line_words) > 8:
+                    if NUM_PREFIX.match(line_text) and len(line_words) > 8:
                         continue
 
                     # Rule 6: General conciseness check for all other potential headings.
@@ -144,13 +187,11 @@ def extract_outline_with_pdfplumber(pdf_path):
                     })
 
             # --- Final Deduplication ---
-            final_outline = []
-            seen = set()
+            # dicts keep insertion order, so setdefault retains the first item for each key
+            unique_items = {}
             for item in outline:
-                identifier = (item['text'].lower(), item['page'])
-                if identifier not in seen:
-                    final_outline.append(item)
-                    seen.add(identifier)
+                unique_items.setdefault((item['text'].lower(), item['page']), item)
+            final_outline = list(unique_items.values())
             
             return {"title": title, "outline": final_outline}
 
@@ -158,10 +199,46 @@ def extract_outline_with_pdfplumber(pdf_path):
         print(f"Error processing PDF '{pdf_path}': {e}", file=sys.stderr)
         return {"title": "Error Processing Document", "outline": []}
 
+def write_json(result, output_path, compact=False):
+    """
+    Writes `result` as UTF-8 JSON in a single write, using orjson when it is installed.
+    Output is indented by 2 spaces (the only indent orjson supports) unless `compact`
+    is set, in which case it is emitted without any whitespace.
+    """
+    if orjson is not None:
+        data = orjson.dumps(result) if compact else orjson.dumps(result, option=orjson.OPT_INDENT_2)
+        with open(output_path, "wb") as f:
+            f.write(data)
+    else:
+        # json.dumps without indent takes the C encoder fast path
+        if compact:
+            data = json.dumps(result, separators=(',', ':'), ensure_ascii=False)
+        else:
+            data = json.dumps(result, indent=2, ensure_ascii=False)
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.write(data)
+
+def process_pdf(pdf_filename, input_dir, output_dir, compact=False):
+    """
+    Extracts the outline of a single PDF from `input_dir` and writes it as JSON to `output_dir`.
+    """
+    pdf_path = os.path.join(input_dir, pdf_filename)
+    output_filename = os.path.splitext(pdf_filename)[0] + ".json"
+    output_path = os.path.join(output_dir, output_filename)
+
+    print(f"Processing '{pdf_filename}'...")
+    result = extract_outline_with_pdfplumber(pdf_path)
+
+    write_json(result, output_path, compact)
+
+    print(f"Outline for '{pdf_filename}' saved to '{output_path}'")
+
 if __name__ == "__main__":
     # Ensure you have installed pdfplumber: pip install pdfplumber
     input_dir = "input"
     output_dir = "output"
+    # Pass --compact to skip indentation when the JSON is only read by other programs
+    compact = "--compact" in sys.argv[1:]
     
     if not os.path.isdir(input_dir):
         print(f"Error: Input directory '{input_dir}' not found.", file=sys.stderr)
@@ -175,15 +252,7 @@ if __name__ == "__main__":
         print(f"No PDF files found in '{input_dir}' directory.")
         sys.exit(0)
 
-    for pdf_filename in pdf_files:
-        pdf_path = os.path.join(input_dir, pdf_filename)
-        output_filename = os.path.splitext(pdf_filename)[0] + ".json"
-        output_path = os.path.join(output_dir, output_filename)
-
-        print(f"Processing '{pdf_filename}'...")
-        result = extract_outline_with_pdfplumber(pdf_path)
-
-        with open(output_path, "w", encoding="utf-8") as f:
-            json.dump(result, f, indent=4, ensure_ascii=False)
-
-        print(f"Outline for '{pdf_filename}' saved to '{output_path}'")
+    # Each PDF is independent and CPU-bound, so spread them across processes.
+    with ProcessPoolExecutor() as executor:
+        list(executor.map(process_pdf, pdf_files, itertools.repeat(input_dir),
+                          itertools.repeat(output_dir), itertools.repeat(compact)))
@@ -1,9 +1,10 @@
 # run_local.py
 import os
-import subprocess
 import glob
 import sys
 
+from src import persona_analyst
+
 def run_scenario(scenario_path, output_base_dir):
     print(f"\n--- Running Scenario: {os.path.basename(scenario_path)} ---")
 
@@ -41,30 +42,12 @@ def run_scenario(scenario_path, output_base_dir):
     os.makedirs(scenario_output_dir, exist_ok=True)
     output_json_path = os.path.join(scenario_output_dir, "challenge1b_output.json")
 
-    # Construct the command to call persona_analyst.py
-    command = [
-        sys.executable, # Use the current Python interpreter
-        os.path.join("src", "persona_analyst.py"),
-        pdf_paths_str,
-        persona_definition,
-        job_to_be_done,
-        output_json_path
-    ]
-
     try:
-        # Run the persona_analyst.py script as a subprocess
-        result = subprocess.run(command, check=True, capture_output=True, text=True)
-        print(result.stdout)
-        if result.stderr:
-            print("Errors from persona_analyst.py:")
-            print(result.stderr, file=sys.stderr)
+        # Call the analyst in-process instead of paying for a fresh interpreter per scenario
+        persona_analyst.run(pdf_paths_str, persona_definition, job_to_be_done, output_json_path)
         print(f"Scenario {os.path.basename(scenario_path)} completed.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error running persona_analyst.py for scenario {os.path.basename(scenario_path)}:", file=sys.stderr)
-        print(e.stdout, file=sys.stderr)
-        print(e.stderr, file=sys.stderr)
-    except FileNotFoundError:
-        print(f"Error: Python executable or src/persona_analyst.py not found. Check your paths.", file=sys.stderr)
+    except Exception as e:
+        print(f"Error running persona_analyst.py for scenario {os.path.basename(scenario_path)}: {e}", file=sys.stderr)
 
 if __name__ == "__main__":
     current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -80,8 +63,10 @@ if __name__ == "__main__":
         print(f"No scenario subdirectories found in '{input_data_base}'. Please create them.")
         sys.exit(0)
 
+    # Scenarios run one after another: the PDFs of each scenario are already parsed in
+    # parallel inside persona_analyst, and running in-process lets every scenario share
+    # a single loaded spaCy model.
     for scenario_name in scenarios:
-        scenario_path = os.path.join(input_data_base, scenario_name)
-        run_scenario(scenario_path, output_results_base)
+        run_scenario(os.path.join(input_data_base, scenario_name), output_results_base)
 
     print("\n--- All scenarios processed. ---")
\ No newline at end of file
@@ -2,12 +2,11 @@
 import os
 import json
 import sys
-import re
+import bisect
+import functools
 import pdfplumber
-import spacy
 from collections import defaultdict
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from datetime import datetime
 
@@ -21,68 +20,181 @@ except ImportError:
     from outline_extractor import extract_outline_with_pdfplumber
 
 
-# Load a spaCy model. This model must be downloaded locally via 'python -m spacy download en_core_web_md'.
-try:
-    nlp = spacy.load("en_core_web_md")
-    print("spaCy model 'en_core_web_md' loaded successfully.")
-except OSError:
-    print("spaCy model 'en_core_web_md' not found. Please ensure it's downloaded locally.", file=sys.stderr)
-    sys.exit(1)
+# spaCy and its model are loaded on first use rather than at import time, so the worker
+# processes that only parse PDFs and CLI usage errors never pay for them.
+_nlp = None
+
+def get_nlp():
+    """
+    Returns the shared spaCy pipeline, loading it on first use.
+    The model must be downloaded locally via 'python -m spacy download en_core_web_md';
+    raises OSError if it is missing.
+    """
+    global _nlp
+    if _nlp is None:
+        import spacy # Deferred: importing spaCy alone takes seconds
+        try:
+            # Only sentence boundaries, lemmas and lexical flags are used. The tagger and
+            # attribute_ruler stay because the rule-based lemmatizer depends on their POS tags.
+            _nlp = spacy.load("en_core_web_md", exclude=["parser", "ner"])
+            # Without the parser, sentence boundaries come from the lighter senter component
+            if "senter" in _nlp.disabled:
+                _nlp.enable_pipe("senter")
+            elif "senter" not in _nlp.pipe_names and "sentencizer" not in _nlp.pipe_names:
+                _nlp.add_pipe("sentencizer", first=True)
+            print("spaCy model 'en_core_web_md' loaded successfully.")
+        except OSError as e:
+            raise OSError("spaCy model 'en_core_web_md' not found. Please ensure it's downloaded locally.") from e
+    return _nlp
+
+def keyword_lemmas(doc):
+    """
+    Returns the token positions and lemma hash ids of the keyword tokens in `doc`:
+    alphabetic tokens that are neither stop words nor punctuation. The token
+    attributes are read in one Doc.to_array call instead of per token.
+    """
+    from spacy.attrs import LEMMA, IS_ALPHA, IS_STOP, IS_PUNCT
+    arr = doc.to_array([LEMMA, IS_ALPHA, IS_STOP, IS_PUNCT])
+    if arr.size == 0:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.uint64)
+    positions = np.flatnonzero((arr[:, 1] == 1) & (arr[:, 2] == 0) & (arr[:, 3] == 0))
+    return positions, arr[positions, 0]
+
+@functools.lru_cache(maxsize=64)
+def _build_query_features(persona_definition, job_to_be_done):
+    """
+    Builds the query text for a persona and job-to-be-done, along with the sorted,
+    distinct lemma ids used to score sentences. Cached, since the same persona and
+    job are often analyzed repeatedly.
+    """
+    # Combine persona and job-to-be-done for a query vector
+    query_text = f"Persona: {persona_definition}. Job: {job_to_be_done}"
+    query_doc = get_nlp()(query_text)
+    # Define keywords for refined text extraction: using spaCy's lemma for robustness
+    query_lemma_ids = np.unique(keyword_lemmas(query_doc)[1])
+    query_lemma_ids.setflags(write=False) # Shared between calls through the cache
+    return query_text, query_lemma_ids
 
-def get_text_content_for_section(pdf_path, page_number, section_title, next_section_page_number=None, next_section_title=None):
+def extract_all_sections_for_pdf(pdf_path, section_boundaries):
     """
-    Extracts text content for a given section from a PDF.
-    This function needs robust implementation to accurately capture content
-    between headings or until the end of a logical section.
-    A more advanced approach would involve iterating through `page.extract_text_lines(layout=True)`
-    and collecting lines until a new heading is detected or page ends.
+    Extracts the text content of every section in `section_boundaries` from a single PDF.
+    The PDF is opened once, the text lines of every page any section spans are
+    extracted once up front and the lines holding each title are indexed, so every
+    section is sliced straight from its own title up to the title of the next
+    section, continuing across page breaks.
+    Returns one string per boundary, in the same order.
     """
-    text_content_parts = []
+    contents = [""] * len(section_boundaries)
     try:
         with pdfplumber.open(pdf_path) as pdf:
-            if page_number > len(pdf.pages):
-                return "" # Invalid page number
-
-            # Start collecting text from the page where the section title appears
-            for current_p_idx in range(page_number - 1, len(pdf.pages)):
-                page = pdf.pages[current_p_idx]
-                lines = page.extract_text_lines(layout=True, strip=True)
-                
-                found_title = False
-                for line_data in lines:
-                    cleaned_line_text = line_data['text'].strip()
-                    
-                    if not found_title:
-                        # Find the actual start of the section by matching the title
-                        if section_title in cleaned_line_text:
-                            found_title = True
-                            # If title is found, start collecting from this point
-                            text_content_parts.append(cleaned_line_text)
-                            continue # Continue to next line
-                        else:
-                            continue # Skip lines before the section title
-                    
-                    # If we found the title, now check for the next section
-                    if next_section_page_number and next_section_title:
-                        if current_p_idx == (next_section_page_number - 1): # If next section is on current page
-                            if next_section_title in cleaned_line_text:
-                                # Stop collecting if we hit the next section's title
-                                break
-                    
-                    text_content_parts.append(cleaned_line_text)
-                
-                # If we've reached the page of the next section, or the end of the document
-                # and still haven't broken, stop here.
-                if next_section_page_number and current_p_idx >= (next_section_page_number - 1):
-                    break
-
+            num_pages = len(pdf.pages)
+            # A section spans from its own page to the next section's page, or to the end of the document.
+            page_spans = [None] * len(section_boundaries)
+            for s_idx, section_info in enumerate(section_boundaries):
+                if section_info['page'] <= num_pages:
+                    end_page = max(section_info['next_page'] or num_pages, section_info['page'])
+                    page_spans[s_idx] = (section_info['page'] - 1, min(end_page, num_pages) - 1)
+
+            # Titles worth looking for on each page: a section's own title on every page it
+            # may start on, and the next section's title on the page where it begins.
+            titles_by_page = defaultdict(set)
+            for section_info, span in zip(section_boundaries, page_spans):
+                if span is None:
+                    continue
+                for p_idx in range(span[0], span[1] + 1):
+                    titles_by_page[p_idx].add(section_info['title'])
+                if section_info['next_page'] and section_info['next_title'] and section_info['next_page'] <= num_pages:
+                    titles_by_page[section_info['next_page'] - 1].add(section_info['next_title'])
+
+            page_lines = {idx: pdf.pages[idx].extract_text_lines(layout=True, strip=True) for idx in sorted(titles_by_page)}
+
+            # Index the lines starting with each title once, instead of rescanning pages per section.
+            # Both sides are compared lowercased and whitespace-collapsed, and only as a prefix,
+            # so a title quoted in the middle of a body line is not mistaken for the heading.
+            title_lines = defaultdict(list)
+            for p_idx, titles in titles_by_page.items():
+                normalized_titles = [(title, ' '.join(title.lower().split())) for title in titles]
+                for line_i, line_data in enumerate(page_lines[p_idx]):
+                    line_norm = ' '.join(line_data['text'].lower().split())
+                    for title, title_norm in normalized_titles:
+                        if line_norm.startswith(title_norm):
+                            title_lines[(p_idx, title)].append(line_i)
+
+            for s_idx, (section_info, span) in enumerate(zip(section_boundaries, page_spans)):
+                if span is None:
+                    continue # Invalid page number
+                first_p_idx, last_p_idx = span
+
+                # Find the actual start of the section: the first line matching its title
+                start = next(((p_idx, title_lines[(p_idx, section_info['title'])][0])
+                              for p_idx in range(first_p_idx, last_p_idx + 1)
+                              if (p_idx, section_info['title']) in title_lines), None)
+                if start is None:
+                    continue
+                start_p_idx, start_line_i = start
+
+                # Stop at the next section's title on its page, after the start line if they share a page
+                stop_p_idx, stop_line_i = None, None
+                if section_info['next_page'] and section_info['next_title']:
+                    stop_p_idx = section_info['next_page'] - 1
+                    hits = title_lines.get((stop_p_idx, section_info['next_title']), [])
+                    if stop_p_idx == start_p_idx:
+                        hits = hits[bisect.bisect_right(hits, start_line_i):]
+                    if hits:
+                        stop_line_i = hits[0]
+
+                # Stitch the section together across every page it spans. Splitting each line
+                # into words as it is collected normalizes the whitespace in the same pass,
+                # so the text is joined exactly once.
+                words = []
+                extend = words.extend
+                for p_idx in range(start_p_idx, last_p_idx + 1):
+                    lines = page_lines[p_idx]
+                    lo = start_line_i if p_idx == start_p_idx else 0
+                    hi = stop_line_i if p_idx == stop_p_idx and stop_line_i is not None else len(lines)
+                    for line_data in lines[lo:hi]:
+                        extend(line_data['text'].split())
+
+                contents[s_idx] = ' '.join(words)
 
     except Exception as e:
-        print(f"Error extracting content for section '{section_title}' from '{pdf_path}': {e}", file=sys.stderr)
+        print(f"Error extracting section content from '{pdf_path}': {e}", file=sys.stderr)
+
+    return contents
+
+
+def _process_one_pdf(pdf_file_path):
+    """
+    Extracts the outline of a single PDF and the text content of each of its sections.
+    Runs in a worker process, so it must not touch the spaCy model.
+    """
+    print(f"Extracting outline for {os.path.basename(pdf_file_path)}...")
+    outline_result = extract_outline_with_pdfplumber(pdf_file_path)
     
-    # Simple post-processing: join lines, remove excessive whitespace
-    full_text = " ".join(text_content_parts)
-    return re.sub(r'\s+', ' ', full_text).strip()
+    # Create a list of section boundaries for accurate text extraction
+    # This helps in knowing when a section ends and the next begins.
+    section_boundaries = []
+    for i, entry in enumerate(outline_result['outline']):
+        section_boundaries.append({
+            "title": entry['text'],
+            "page": entry['page'],
+            "doc_path": pdf_file_path,
+            "next_title": outline_result['outline'][i+1]['text'] if i+1 < len(outline_result['outline']) else None,
+            "next_page": outline_result['outline'][i+1]['page'] if i+1 < len(outline_result['outline']) else None
+        })
+
+    section_contents = extract_all_sections_for_pdf(pdf_file_path, section_boundaries)
+
+    sections = []
+    for section_info, section_content in zip(section_boundaries, section_contents):
+        sections.append({
+            "document": os.path.basename(section_info['doc_path']),
+            "page_number": section_info['page'],
+            "section_title": section_info['title'],
+            "full_text_content": section_content, # Store full content for analysis
+            "importance_rank": 0 # Placeholder for now
+        })
+    return sections
 
 
 def analyze_document_collection(pdf_file_paths, persona_definition, job_to_be_done):
@@ -97,47 +209,23 @@ def analyze_document_collection(pdf_file_paths, persona_definition, job_to_be_do
         "processing_timestamp": datetime.now().isoformat()
     }
 
-    # Step 1: Extract outlines and gather all potential sections from all PDFs
-    for pdf_file_path in pdf_file_paths:
-        print(f"Extracting outline for {os.path.basename(pdf_file_path)}...")
-        outline_result = extract_outline_with_pdfplumber(pdf_file_path)
-        
-        # Create a list of section boundaries for accurate text extraction
-        # This helps in knowing when a section ends and the next begins.
-        section_boundaries = []
-        for i, entry in enumerate(outline_result['outline']):
-            section_boundaries.append({
-                "title": entry['text'],
-                "page": entry['page'],
-                "doc_path": pdf_file_path,
-                "next_title": outline_result['outline'][i+1]['text'] if i+1 < len(outline_result['outline']) else None,
-                "next_page": outline_result['outline'][i+1]['page'] if i+1 < len(outline_result['outline']) else None
-            })
-
-        for section_info in section_boundaries:
-            section_content = get_text_content_for_section(
-                section_info['doc_path'],
-                section_info['page'],
-                section_info['title'],
-                section_info['next_page'],
-                section_info['next_title']
-            )
-            
-            all_extracted_sections.append({
-                "document": os.path.basename(section_info['doc_path']),
-                "page_number": section_info['page'],
-                "section_title": section_info['title'],
-                "full_text_content": section_content, # Store full content for analysis
-                "importance_rank": 0 # Placeholder for now
-            })
+    # Step 1: Extract outlines and gather all potential sections from all PDFs.
+    # Each PDF is parsed independently, so spread them across worker processes.
+    max_workers = max(1, min(os.cpu_count() or 1, len(pdf_file_paths)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for sections in executor.map(_process_one_pdf, pdf_file_paths):
+            all_extracted_sections.extend(sections)
 
     if not all_extracted_sections:
         return {"metadata": metadata, "extracted_sections": [], "sub_section_analysis": []}
 
     # Step 2: Semantic Analysis and Ranking
-    # Combine persona and job-to-be-done for a query vector
-    query_text = f"Persona: {persona_definition}. Job: {job_to_be_done}"
-    query_doc = nlp(query_text)
+    # scikit-learn is imported here rather than at module level so that usage errors,
+    # argument validation and the PDF worker processes don't pay for loading it.
+    from sklearn.feature_extraction.text import HashingVectorizer
+    from sklearn.preprocessing import normalize
+
+    query_text, query_lemma_ids = _build_query_features(persona_definition, job_to_be_done)
 
     # Prepare texts for TF-IDF vectorization
     section_texts = [sec["full_text_content"] for sec in all_extracted_sections]
@@ -145,58 +233,72 @@ def analyze_document_collection(pdf_file_paths, persona_definition, job_to_be_do
     # Add query text to the corpus for consistent vectorization
     corpus = section_texts + [query_text]
 
-    # Use TF-IDF for basic keyword importance and cosine similarity
-    vectorizer = TfidfVectorizer(stop_words='english', max_features=5000) # Limit features for smaller model footprint
-    tfidf_matrix = vectorizer.fit_transform(corpus)
+    # Use TF-IDF for basic keyword importance and cosine similarity.
+    # Terms are hashed into a fixed number of columns, so no vocabulary has to be built
+    # or kept in memory; the IDF weighting is then applied on top of the raw counts.
+    # Rows are L2-normalized, so a plain dot product below is already the cosine similarity
+    vectorizer = HashingVectorizer(stop_words='english', n_features=2**14, norm=None, alternate_sign=False, dtype=np.float32) # Fixed feature count for a small footprint
+    tfidf_matrix = vectorizer.transform(corpus)
+    # Smoothed IDF as TfidfTransformer computes it, but scaled into the stored values in place
+    # rather than through a sparse matmul against a diagonal matrix that copies the counts.
+    n_docs = tfidf_matrix.shape[0]
+    doc_freq = np.bincount(tfidf_matrix.indices, minlength=tfidf_matrix.shape[1])
+    idf = (np.log((n_docs + 1) / (doc_freq + 1)) + 1.0).astype(np.float32)
+    tfidf_matrix.data *= idf[tfidf_matrix.indices]
+    normalize(tfidf_matrix, norm='l2', copy=False)
 
     # The last vector in tfidf_matrix is for the query
     query_vector = tfidf_matrix[-1]
     section_vectors = tfidf_matrix[:-1]
 
     # Calculate cosine similarity between query and each section
-    similarities = cosine_similarity(query_vector, section_vectors).flatten()
+    similarities = (section_vectors @ query_vector.T).toarray().ravel()
 
     # Assign rank based on similarity
-    ranked_sections = []
     for i, section in enumerate(all_extracted_sections):
         section["importance_rank"] = float(similarities[i]) # Store as float for JSON
-        ranked_sections.append(section)
 
-    # Sort sections by importance rank in descending order
-    ranked_sections.sort(key=lambda x: x["importance_rank"], reverse=True)
+    # Sort sections by importance rank in descending order. The output lists every section,
+    # so a full ordering is needed anyway and the top N for the sub-section analysis are
+    # just its first entries. kind='stable' keeps ties in document order, like list.sort.
+    ranked_order = np.argsort(-similarities, kind='stable')
+    ranked_sections = [all_extracted_sections[i] for i in ranked_order]
 
     # Step 3: Sub-Section Analysis (Refinement)
     sub_section_analysis = []
     # Analyze top N most relevant sections based on initial ranking.
     top_n_sections_for_sub_analysis = 5 # As per prompt examples, refine top relevant
-    
-    # Define keywords for refined text extraction: using spaCy's lemma for robustness
-    query_keywords = [token.lemma_ for token in query_doc if token.is_alpha and not token.is_stop and not token.is_punct]
-    
-    for i, section in enumerate(ranked_sections):
-        if i >= top_n_sections_for_sub_analysis:
-            break
+    top_sections = [sec for sec in ranked_sections[:top_n_sections_for_sub_analysis] if sec["full_text_content"]]
 
-        if not section["full_text_content"]:
-            continue
-
-        doc = nlp(section["full_text_content"])
-        relevant_sentences = []
+    # Run the top sections through spaCy as a single batch.
+    # n_process stays at 1: each extra process loads its own copy of the model, which costs
+    # far more than the handful of documents parsed here.
+    batch_size = int(os.environ.get("SPACY_BATCH_SIZE", 8))
+    docs = get_nlp().pipe([sec["full_text_content"] for sec in top_sections], batch_size=batch_size)
+    
+    for section, doc in zip(top_sections, docs):
+        sents = list(doc.sents)
+        positions, lemma_ids = keyword_lemmas(doc)
+        # Sentence of each keyword token, then one entry per distinct (sentence, lemma) pair
+        sent_of_token = np.searchsorted([sent.start for sent in sents], positions, side='right') - 1
+        pairs = np.unique(np.stack([sent_of_token.astype(np.uint64), lemma_ids]), axis=1)
+        pair_sents = pairs[0].astype(np.intp)
+
+        # Use Jaccard similarity or simple keyword overlap for sentence relevance,
+        # for every sentence at once: distinct lemmas per sentence and how many are in the query
+        sent_card = np.bincount(pair_sents, minlength=len(sents))
+        intersection = np.bincount(pair_sents[np.isin(pairs[1], query_lemma_ids)], minlength=len(sents))
+        union = sent_card + len(query_lemma_ids) - intersection
+        jaccard_similarity = intersection / np.maximum(union, 1) # Avoid division by zero
         
-        for sent in doc.sents:
-            sent_keywords = [token.lemma_ for token in sent if token.is_alpha and not token.is_stop and not token.is_punct]
-            
-            # Use Jaccard similarity or simple keyword overlap for sentence relevance
-            intersection = len(set(query_keywords) & set(sent_keywords))
-            union = len(set(query_keywords) | set(sent_keywords))
-            
-            if union > 0: # Avoid division by zero
-                jaccard_similarity = intersection / union
-                if jaccard_similarity > 0.05: # Threshold for considering a sentence relevant
-                    relevant_sentences.append(sent.text.strip())
+        relevant_sentences = []
+        current_refined_text_length = 0
+        for s_idx in np.flatnonzero(jaccard_similarity > 0.05): # Threshold for considering a sentence relevant
+            sentence_text = sents[s_idx].text.strip()
+            relevant_sentences.append(sentence_text)
             
-            # Implement a character limit for refined text
-            current_refined_text_length = sum(len(s) for s in relevant_sentences)
+            # Implement a character limit for refined text, keeping a running total of the sentence lengths
+            current_refined_text_length += len(sentence_text)
             if current_refined_text_length > 1000: # Example limit for refined text block
                 break
 
@@ -207,8 +309,11 @@ def analyze_document_collection(pdf_file_paths, persona_definition, job_to_be_do
                 "refined_text": " ".join(relevant_sentences) # Join all relevant sentences
             })
             
-    # Remove 'full_text_content' from main sections for final output to match format
-    final_extracted_sections = [{k: v for k, v in sec.items() if k != 'full_text_content'} for sec in ranked_sections]
+    # Remove 'full_text_content' from main sections for final output to match format.
+    # The section dicts are not used past this point, so drop the key in place rather than copying them.
+    for sec in ranked_sections:
+        sec.pop('full_text_content', None)
+    final_extracted_sections = ranked_sections
 
     return {
         "metadata": metadata,
@@ -216,44 +321,48 @@ def analyze_document_collection(pdf_file_paths, persona_definition, job_to_be_do
         "sub_section_analysis": sub_section_analysis
     }
 
-if __name__ == "__main__":
-    # This script is designed to be called by run_local.py for local testing.
-    # It expects: <pdf_file_paths> <persona_definition> <job_to_be_done> <output_json_path>
-    # Note: pdf_file_paths should be a comma-separated string for simplicity in CLI.
-
-    if len(sys.argv) < 5:
-        print("Usage: python src/persona_analyst.py <comma_separated_pdf_paths> <persona_definition_str> <job_to_be_done_str> <output_json_path>")
-        print("Example: python src/persona_analyst.py \"input_data/scenario1/doc1.pdf,input_data/scenario1/doc2.pdf\" \"PhD Researcher\" \"Comprehensive literature review\" output_results/scenario1_output.json")
-        sys.exit(1)
-
-    pdf_paths_str = sys.argv[1]
-    persona_def = sys.argv[2]
-    job_def = sys.argv[3]
-    output_json_path = sys.argv[4]
-
+def run(pdf_paths_str, persona_definition, job_to_be_done, output_json_path):
+    """
+    Runs the analysis for a comma-separated list of PDF paths and writes the
+    result as JSON to `output_json_path`.
+    """
     pdf_files = [p.strip() for p in pdf_paths_str.split(',') if p.strip()]
     if not pdf_files:
-        print("Error: No PDF file paths provided.", file=sys.stderr)
-        sys.exit(1)
+        raise ValueError("No PDF file paths provided.")
 
     for p_file in pdf_files:
         if not os.path.exists(p_file):
-            print(f"Error: PDF file not found at '{p_file}'. Please check path.", file=sys.stderr)
-            sys.exit(1)
+            raise FileNotFoundError(f"PDF file not found at '{p_file}'. Please check path.")
 
     # Ensure output directory exists
     output_dir = os.path.dirname(output_json_path)
     if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
 
     print(f"Starting analysis for scenario:")
     print(f"  PDFs: {[os.path.basename(f) for f in pdf_files]}")
-    print(f"  Persona: '{persona_def}'")
-    print(f"  Job: '{job_def}'")
+    print(f"  Persona: '{persona_definition}'")
+    print(f"  Job: '{job_to_be_done}'")
 
-    result = analyze_document_collection(pdf_files, persona_def, job_def)
+    result = analyze_document_collection(pdf_files, persona_definition, job_to_be_done)
 
     with open(output_json_path, "w", encoding="utf-8") as f:
         json.dump(result, f, indent=4, ensure_ascii=False)
 
-    print(f"Analysis complete. Output saved to '{output_json_path}'")
\ No newline at end of file
+    print(f"Analysis complete. Output saved to '{output_json_path}'")
+
+if __name__ == "__main__":
+    # This script is designed to be called by run_local.py for local testing.
+    # It expects: <pdf_file_paths> <persona_definition> <job_to_be_done> <output_json_path>
+    # Note: pdf_file_paths should be a comma-separated string for simplicity in CLI.
+
+    if len(sys.argv) < 5:
+        print("Usage: python src/persona_analyst.py <comma_separated_pdf_paths> <persona_definition_str> <job_to_be_done_str> <output_json_path>")
+        print("Example: python src/persona_analyst.py \"input_data/scenario1/doc1.pdf,input_data/scenario1/doc2.pdf\" \"PhD Researcher\" \"Comprehensive literature review\" output_results/scenario1_output.json")
+        sys.exit(1)
+
+    try:
+        run(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
+    except (ValueError, OSError) as e: # OSError covers missing PDFs and a missing spaCy model
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)